@@ -5,7 +5,10 @@ import pandas as pd
 from style import apply_custom_style, create_track_card, create_stats_section, create_search_bar, create_playlist_card
 from artist import ArtistSimilarity
 from songs import SongSimilarity
+from images import ImageCache, pick_image_url
+from tracing import annotate, trace_request, traced_client
 import numpy as np
+import os
 
 # Apply custom styling
 apply_custom_style()
@@ -15,154 +18,234 @@ client_credentials_manager = SpotifyClientCredentials(
     client_id=CLIENT_ID,
     client_secret=CLIENT_SECRET
 )
-sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+# Split the artist/song caches across this many shard worker processes
+CACHE_SHARDS = int(os.getenv('SPOTIFY_CACHE_SHARDS', '1'))
 
-# Initialize similarity engines
-artist_similarity = ArtistSimilarity(sp)
-song_similarity = SongSimilarity(sp)
+sp = traced_client(spotipy.Spotify(client_credentials_manager=client_credentials_manager))
 
-st.title('🎵 Spotify Music Explorer')
+# Profiles hold every track ID of the playlist, so keep only a few recent ones
+@st.cache_data(show_spinner=False, max_entries=16, ttl=3600)
+def load_playlist_profile(_song_similarity, playlist_id, snapshot_id):
+    """Build a playlist profile once per playlist version instead of on every rerun"""
+    return _song_similarity.build_playlist_profile(playlist_id)
 
-# Sidebar navigation
-page = st.sidebar.radio("Navigation", ["Search Songs", "Search Artists"])
+@st.cache_resource
+def get_image_cache():
+    """Share one thumbnail cache (and its byte count) across every session"""
+    return ImageCache()
 
-if page == "Search Songs":
-    # Create styled search bar
-    search_query = create_search_bar()
+@st.cache_resource
+def get_similarity_engines():
+    """Load the caches (and start any shard workers) once per process"""
+    return ArtistSimilarity(sp, shards=CACHE_SHARDS), SongSimilarity(sp, shards=CACHE_SHARDS)
 
-    if search_query:
-        # Search for tracks
-        results = sp.search(q=search_query, limit=10, type='track')
+def main():
+    """Render the selected page"""
+    # Initialize similarity engines
+    artist_similarity, song_similarity = get_similarity_engines()
+    image_cache = get_image_cache()
+
+    st.title('🎵 Spotify Music Explorer')
+
+    # Sidebar navigation
+    page = st.sidebar.radio("Navigation", ["Search Songs", "Search Artists", "Playlist Recommendations"])
+    annotate(page=page)
+
+    if page == "Search Songs":
+        # Create styled search bar
+        search_query = create_search_bar()
+
+        if search_query:
+            # Search for tracks
+            results = sp.search(q=search_query, limit=10, type='track')
         
-        if results['tracks']['items']:
-            # Create a list of track names for the selectbox
-            track_names = [f"{item['name']} - {item['artists'][0]['name']}" for item in results['tracks']['items']]
+            if results['tracks']['items']:
+                # Create a list of track names for the selectbox
+                track_names = [f"{item['name']} - {item['artists'][0]['name']}" for item in results['tracks']['items']]
             
-            # Display selectbox with search results
-            selected_track = st.selectbox(
-                'Select a track to view details:',
-                track_names
-            )
+                # Display selectbox with search results
+                selected_track = st.selectbox(
+                    'Select a track to view details:',
+                    track_names
+                )
             
-            # Find the selected track's details
-            selected_index = track_names.index(selected_track)
-            track = results['tracks']['items'][selected_index]
+                # Find the selected track's details
+                selected_index = track_names.index(selected_track)
+                track = results['tracks']['items'][selected_index]
             
-            # Create track card with main information
-            create_track_card(track)
+                # Create track card with main information
+                create_track_card(track, pick_image_url(track['album']['images'], 150))
             
-            # Create stats section
-            create_stats_section(track)
+                # Create stats section
+                create_stats_section(track)
             
-            # Additional track information
-            st.markdown("### 📝 Additional Information")
-            st.markdown(f"**Release Date:** {track['album']['release_date']}")
-            st.markdown(f"**Album Type:** {track['album']['album_type'].title()}")
+                # Additional track information
+                st.markdown("### 📝 Additional Information")
+                st.markdown(f"**Release Date:** {track['album']['release_date']}")
+                st.markdown(f"**Album Type:** {track['album']['album_type'].title()}")
             
-            # Display available markets in a more compact way
-            if track['available_markets']:
-                st.markdown(f"**Available in {len(track['available_markets'])} markets**")
+                # Display available markets in a more compact way
+                if track['available_markets']:
+                    st.markdown(f"**Available in {len(track['available_markets'])} markets**")
             
-            # Similar Songs section
-            st.markdown("### 🎵 Similar Songs")
-            similar_songs = song_similarity.find_similar_songs(track['id'])
+                # Similar Songs section
+                st.markdown("### 🎵 Similar Songs")
+                similar_songs = song_similarity.find_similar_cached_songs(track['id'], track=track)
+                if not similar_songs:
+                    # Fall back to popular songs until the catalogue has been built up
+                    similar_songs = [
+                        {
+                            'name': song['name'],
+                            'artist': song['artists'][0]['name'],
+                            'album': song['album']['name'],
+                            'image_url': pick_image_url(song['album']['images'], 100)
+                        }
+                        for song in song_similarity.find_similar_songs(track['id'])
+                    ]
             
-            if similar_songs:
-                cols = st.columns(3)
-                for idx, similar in enumerate(similar_songs):
-                    with cols[idx]:
-                        if similar['album']['images']:
-                            st.image(similar['album']['images'][0]['url'], width=100)
-                        st.markdown(f"**{similar['name']}**")
-                        st.markdown(f"*{similar['artists'][0]['name']}*")
-                        st.markdown(f"Album: {similar['album']['name']}")
+                if similar_songs:
+                    cols = st.columns(3)
+                    for idx, similar in enumerate(similar_songs):
+                        with cols[idx]:
+                            if similar['image_url']:
+                                st.image(image_cache.get_thumbnail(similar['image_url'], 100) or similar['image_url'], width=100)
+                            st.markdown(f"**{similar['name']}**")
+                            st.markdown(f"*{similar['artist']}*")
+                            st.markdown(f"Album: {similar['album']}")
+                else:
+                    st.info("No similar songs found.")
             else:
-                st.info("No similar songs found.")
-        else:
-            st.error("No results found. Try a different search term.")
+                st.error("No results found. Try a different search term.")
 
-elif page == "Search Artists":
-    st.header("Search Artists")
+    elif page == "Search Artists":
+        st.header("Search Artists")
     
-    # Create styled search bar for artists
-    artist_query = st.text_input('', placeholder='Enter artist name...', key='artist_search')
+        # Create styled search bar for artists
+        artist_query = st.text_input('', placeholder='Enter artist name...', key='artist_search')
     
-    if artist_query:
-        try:
-            # Search for artists
-            results = sp.search(q=artist_query, limit=10, type='artist')
+        if artist_query:
+            try:
+                # Search for artists
+                results = sp.search(q=artist_query, limit=10, type='artist')
             
-            if results['artists']['items']:
-                # Create a list of artist names for the selectbox
-                artist_names = [f"{item['name']} ({item['genres'][0] if item['genres'] else 'No genre'})" 
-                              for item in results['artists']['items']]
+                if results['artists']['items']:
+                    # Create a list of artist names for the selectbox
+                    artist_names = [f"{item['name']} ({item['genres'][0] if item['genres'] else 'No genre'})" 
+                                  for item in results['artists']['items']]
                 
-                # Display selectbox with search results
-                selected_artist = st.selectbox(
-                    'Select an artist to view details:',
-                    artist_names
-                )
+                    # Display selectbox with search results
+                    selected_artist = st.selectbox(
+                        'Select an artist to view details:',
+                        artist_names
+                    )
                 
-                # Find the selected artist's details
-                selected_index = artist_names.index(selected_artist)
-                artist = results['artists']['items'][selected_index]
+                    # Find the selected artist's details
+                    selected_index = artist_names.index(selected_artist)
+                    artist = results['artists']['items'][selected_index]
                 
-                # Get artist features
-                artist_features = artist_similarity.get_artist_features(artist['id'])
+                    # Get artist features
+                    artist_features = artist_similarity.get_artist_features(artist['id'])
                 
-                # Display artist information
-                col1, col2 = st.columns([1, 2])
+                    # Display artist information
+                    col1, col2 = st.columns([1, 2])
                 
-                with col1:
-                    if artist['images']:
-                        st.image(artist['images'][0]['url'], width=200)
+                    with col1:
+                        if artist['images']:
+                            st.image(image_cache.image_source(artist['images'], 200), width=200)
                 
-                with col2:
-                    st.subheader(artist['name'])
-                    st.markdown(f"**Popularity:** {artist['popularity']}/100")
-                    if artist['genres']:
-                        st.markdown("**Genres:** " + ", ".join(artist['genres']))
+                    with col2:
+                        st.subheader(artist['name'])
+                        st.markdown(f"**Popularity:** {artist['popularity']}/100")
+                        if artist['genres']:
+                            st.markdown("**Genres:** " + ", ".join(artist['genres']))
                     
-                    # Display audio features if available
-                    if artist_features and artist_features['top_tracks']:
-                        avg_features = {
-                            'danceability': np.mean([t['danceability'] for t in artist_features['top_tracks']]),
-                            'energy': np.mean([t['energy'] for t in artist_features['top_tracks']]),
-                            'valence': np.mean([t['valence'] for t in artist_features['top_tracks']]),
-                            'tempo': np.mean([t['tempo'] for t in artist_features['top_tracks']])
-                        }
-                        st.markdown("### Audio Features")
-                        st.markdown(f"**Danceability:** {avg_features['danceability']:.2f}")
-                        st.markdown(f"**Energy:** {avg_features['energy']:.2f}")
-                        st.markdown(f"**Valence:** {avg_features['valence']:.2f}")
-                        st.markdown(f"**Tempo:** {avg_features['tempo']:.0f} BPM")
+                        # Display audio features if available
+                        if artist_features and artist_features['top_tracks']:
+                            avg_features = {
+                                'danceability': np.mean([t['danceability'] for t in artist_features['top_tracks']]),
+                                'energy': np.mean([t['energy'] for t in artist_features['top_tracks']]),
+                                'valence': np.mean([t['valence'] for t in artist_features['top_tracks']]),
+                                'tempo': np.mean([t['tempo'] for t in artist_features['top_tracks']])
+                            }
+                            st.markdown("### Audio Features")
+                            st.markdown(f"**Danceability:** {avg_features['danceability']:.2f}")
+                            st.markdown(f"**Energy:** {avg_features['energy']:.2f}")
+                            st.markdown(f"**Valence:** {avg_features['valence']:.2f}")
+                            st.markdown(f"**Tempo:** {avg_features['tempo']:.0f} BPM")
                     
-                    # Get artist's top tracks
-                    st.markdown("### Top Tracks")
-                    top_tracks = sp.artist_top_tracks(artist['id'])
+                        # Get artist's top tracks
+                        st.markdown("### Top Tracks")
+                        top_tracks = sp.artist_top_tracks(artist['id'])
                     
-                    if top_tracks['tracks']:
-                        for track in top_tracks['tracks'][:5]:  # Show top 5 tracks
-                            st.markdown(f"• {track['name']} - {track['album']['name']}")
+                        if top_tracks['tracks']:
+                            for track in top_tracks['tracks'][:5]:  # Show top 5 tracks
+                                st.markdown(f"• {track['name']} - {track['album']['name']}")
                     
-                    # Get similar artists using our custom algorithm
-                    st.markdown("### Similar Artists")
-                    similar_artists = artist_similarity.find_similar_artists(artist['id'])
+                        # Get similar artists using our custom algorithm
+                        st.markdown("### Similar Artists")
+                        similar_artists = artist_similarity.find_similar_cached_artists(artist['id'])
+                        if not similar_artists:
+                            # Fall back to popular artists until the catalogue has been built up
+                            similar_artists = [
+                                {
+                                    'name': similar['name'],
+                                    'genres': similar['genres'],
+                                    'image_url': pick_image_url(similar['images'], 100)
+                                }
+                                for similar in artist_similarity.find_similar_artists(artist['id'])
+                            ]
                     
-                    if similar_artists:
-                        cols = st.columns(3)
-                        for idx, similar in enumerate(similar_artists):
-                            with cols[idx]:
-                                if similar['images']:
-                                    st.image(similar['images'][0]['url'], width=100)
-                                st.markdown(f"**{similar['name']}**")
-                                if similar['genres']:
-                                    st.markdown(f"*{similar['genres'][0]}*")
-                    else:
-                        st.info("No similar artists found.")
-            else:
-                st.error("No artists found. Try a different search term.")
-        except Exception as e:
-            st.error(f"Error searching for artists: {str(e)}")
-            st.info("Please try again with a different search term.")
+                        if similar_artists:
+                            cols = st.columns(3)
+                            for idx, similar in enumerate(similar_artists):
+                                with cols[idx]:
+                                    if similar['image_url']:
+                                        st.image(image_cache.get_thumbnail(similar['image_url'], 100) or similar['image_url'], width=100)
+                                    st.markdown(f"**{similar['name']}**")
+                                    if similar['genres']:
+                                        st.markdown(f"*{similar['genres'][0]}*")
+                        else:
+                            st.info("No similar artists found.")
+                else:
+                    st.error("No artists found. Try a different search term.")
+            except Exception as e:
+                st.error(f"Error searching for artists: {str(e)}")
+                st.info("Please try again with a different search term.")
+
+    elif page == "Playlist Recommendations":
+        st.header("Playlist Recommendations")
+    
+        # Accept a playlist ID, URI or share link
+        playlist_query = st.text_input('', placeholder='Enter a Spotify playlist link or ID...', key='playlist_search')
+    
+        if playlist_query:
+            try:
+                playlist = sp.playlist(playlist_query, fields='id,name,snapshot_id,images,tracks.total,owner.display_name,external_urls')
+                create_playlist_card(playlist, pick_image_url(playlist['images'], 300))
+            
+                with st.spinner(f"Analysing {playlist['tracks']['total']} tracks..."):
+                    # snapshot_id changes whenever the playlist is edited
+                    profile = load_playlist_profile(song_similarity, playlist['id'], playlist['snapshot_id'])
+                    recommendations = song_similarity.recommend_from_profile(profile)
+            
+                st.markdown("### 🎵 Recommended Songs")
+                if recommendations:
+                    cols = st.columns(3)
+                    for idx, song in enumerate(recommendations):
+                        with cols[idx % 3]:
+                            if song['image_url']:
+                                st.image(image_cache.get_thumbnail(song['image_url'], 100) or song['image_url'], width=100)
+                            st.markdown(f"**{song['name']}**")
+                            st.markdown(f"*{song['artist']}*")
+                            st.markdown(f"Album: {song['album']}")
+                else:
+                    st.info("No recommendations found. Explore more songs to grow the catalogue.")
+            except Exception as e:
+                st.error(f"Error loading playlist: {str(e)}")
+                st.info("Please check the playlist link and try again.")
 
+# Trace the whole render when SPOTIFY_TRACE=1 (see tracing.py); with tracing on,
+# add ?profile=1 to the URL to profile a single run
+profile_run = st.query_params.pop('profile', None) == '1'
+with trace_request('page_render', profile=profile_run):
+    main()
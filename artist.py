@@ -6,20 +6,35 @@ from typing import List, Dict
 from collections import Counter
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 import pathlib
+from shards import ShardedStore, ensure_layout, top_k
+from tracing import traced
+import snapshots
 
 class ArtistSimilarity:
-    def __init__(self, sp_client: spotipy.Spotify):
+    def __init__(self, sp_client: spotipy.Spotify, shards: int = 1):
         self.sp = sp_client
         self.cache = {}
         # Use the Spotify folder for cache
         self.data_file = pathlib.Path('Spotify/artist_cache.json')
+        # High-water marks of snapshots imported from each peer node
+        self.peers_file = pathlib.Path('Spotify/artist_peers.json')
+        # Partition the cache across shard files queried by worker processes
+        if shards > 1:
+            self.cache = ShardedStore(self.data_file, shards)
         self.load_cached_data()
         
+    @traced('artist_cache.load')
     def load_cached_data(self):
         """Load artist data from local storage."""
+        if isinstance(self.cache, ShardedStore):
+            self.cache.load()
+            return
+
         try:
+            # Fold shard files from an earlier sharded run back into the single file
+            ensure_layout(self.data_file, 1)
             if self.data_file.exists():
                 with open(self.data_file, 'r', encoding='utf-8') as f:
                     self.cache = json.load(f)
@@ -36,8 +51,13 @@ class ArtistSimilarity:
             self.cache = {}
             self.save_cached_data()
     
+    @traced('artist_cache.save')
     def save_cached_data(self):
         """Save artist data to local storage."""
+        if isinstance(self.cache, ShardedStore):
+            self.cache.save()
+            return
+
         try:
             # Create backup of existing file if it exists
             if self.data_file.exists():
@@ -76,11 +96,40 @@ class ArtistSimilarity:
                 except Exception as backup_error:
                     print(f"Error restoring from backup: {str(backup_error)}")
 
+    def export_snapshot(self, path: str, since: str = None) -> int:
+        """Export artist data (or only entries changed after a peer's `since` watermark) to a snapshot file."""
+        try:
+            return snapshots.export_snapshot(self.cache, pathlib.Path(path), 'artist', since=since)
+        except Exception as e:
+            print(f"Error exporting snapshot: {str(e)}")
+            return 0
+
+    @traced('artist_cache.import_snapshot')
+    def import_snapshot(self, path: str) -> int:
+        """Merge a peer's snapshot into the cache, keeping the newest copy of each artist."""
+        try:
+            snapshot = snapshots.read_snapshot(pathlib.Path(path), 'artist')
+            merged = snapshots.merge_entries(self.cache, snapshot['entries'])
+            print(f"Merged {merged} of {snapshot['count']} artists from {path}")
+            if merged:
+                self.save_cached_data()
+            snapshots.record_watermark(self.peers_file, snapshot)
+            return merged
+        except Exception as e:
+            print(f"Error importing snapshot: {str(e)}")
+            return 0
+
+    def peer_watermark(self, node: str) -> str:
+        """Return the `since` value to request the next delta from a peer node."""
+        return snapshots.load_watermarks(self.peers_file).get(node)
+
+    @traced('artist.get_artist_features')
     def get_artist_features(self, artist_id: str) -> Dict:
         """Get essential features for an artist."""
-        if artist_id in self.cache:
-            print(f"Retrieved {self.cache[artist_id]['name']} from cache")
-            return self.cache[artist_id]
+        cached = self.cache.get(artist_id)
+        if cached:
+            print(f"Retrieved {cached['name']} from cache")
+            return cached
             
         try:
             print(f"Fetching data for artist ID: {artist_id}")
@@ -102,7 +151,7 @@ class ArtistSimilarity:
                 'followers': artist['followers']['total'],
                 'top_tracks': [],
                 'audio_features': [],
-                'last_updated': datetime.now().isoformat(),
+                'last_updated': datetime.now(timezone.utc).isoformat(),
                 'image_url': artist['images'][0]['url'] if artist['images'] else None
             }
             
@@ -137,7 +186,8 @@ class ArtistSimilarity:
             print(f"Error getting features for artist {artist_id}: {str(e)}")
             return None
 
-    def calculate_similarity(self, artist1_features: Dict, artist2_features: Dict) -> float:
+    @staticmethod
+    def calculate_similarity(artist1_features: Dict, artist2_features: Dict) -> float:
         """Calculate similarity between two artists using multiple features."""
         if not artist1_features or not artist2_features:
             return 0.0
@@ -192,6 +242,26 @@ class ArtistSimilarity:
         
         return final_similarity
 
+    @traced('artist.find_similar_cached_artists')
+    def find_similar_cached_artists(self, artist_id: str, limit: int = 3) -> List[Dict]:
+        """Rank cached artists by similarity to the given artist."""
+        features = self.get_artist_features(artist_id)
+        if not features:
+            return []
+
+        try:
+            return top_k(
+                self.cache,
+                ArtistSimilarity.calculate_similarity,
+                features,
+                limit,
+                exclude=[artist_id]
+            )
+        except Exception as e:
+            print(f"Error ranking cached artists: {str(e)}")
+            return []
+
+    @traced('artist.find_similar_artists')
     def find_similar_artists(self, artist_id: str, limit: int = 3) -> List[Dict]:
         """Find popular artists to display in the similar artists section."""
         try:
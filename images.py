@@ -0,0 +1,107 @@
+import hashlib
+import io
+import os
+import pathlib
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+import requests
+from PIL import Image
+
+from tracing import traced
+
+
+def pick_image_url(images: List[Dict], size: int) -> Optional[str]:
+    """Pick the smallest Spotify image that is still at least `size` pixels wide."""
+    if not images:
+        return None
+    # Spotify usually returns 640/300/64px variants; width can be missing
+    sized = [img for img in images if img.get('width')]
+    if not sized:
+        return images[0]['url']
+    large_enough = [img for img in sized if img['width'] >= size]
+    if large_enough:
+        return min(large_enough, key=lambda img: img['width'])['url']
+    return max(sized, key=lambda img: img['width'])['url']
+
+
+class ImageCache:
+    def __init__(self, cache_dir: str = 'Spotify/image_cache', max_bytes: int = 50 * 1024 * 1024):
+        # Use the Spotify folder for cache
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Counted once; the cache is meant to be shared by every session in the process
+        self.total_bytes = sum(f.stat().st_size for f in self.cache_dir.glob('*.jpg'))
+        self.lock = threading.Lock()
+
+    def _thumbnail_path(self, url: str, size: int) -> pathlib.Path:
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return self.cache_dir / f'{key}_{size}.jpg'
+
+    @traced('image_cache.get_thumbnail')
+    def get_thumbnail(self, url: str, size: int) -> Optional[str]:
+        """Return a local path to a `size`px thumbnail of `url`, downloading it once."""
+        if not url:
+            return None
+
+        path = self._thumbnail_path(url, size)
+        if path.exists():
+            # Bump the mtime so eviction treats this file as recently used
+            os.utime(path, None)
+            return str(path)
+
+        try:
+            response = requests.get(url, timeout=10)
+            response.raise_for_status()
+
+            image = Image.open(io.BytesIO(response.content)).convert('RGB')
+            image.thumbnail((size, size))
+            # Write to a temp file and rename it so other sessions never see a partial JPEG
+            fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    image.save(f, format='JPEG', quality=85, optimize=True)
+                with self.lock:
+                    # Another session may have cached the same image meanwhile
+                    old_size = path.stat().st_size if path.exists() else 0
+                    os.replace(tmp_name, path)
+                    self.total_bytes += path.stat().st_size - old_size
+                    self.evict()
+            except Exception:
+                if os.path.exists(tmp_name):
+                    os.unlink(tmp_name)
+                raise
+            return str(path)
+
+        except Exception as e:
+            print(f"Error caching image {url}: {str(e)}")
+            return None
+
+    def image_source(self, images: List[Dict], size: int) -> Optional[str]:
+        """Get a local thumbnail path for st.image, falling back to the CDN URL."""
+        url = pick_image_url(images, size)
+        if not url:
+            return None
+        return self.get_thumbnail(url, size) or url
+
+    def evict(self):
+        """Remove least recently used thumbnails until the cache fits in max_bytes.
+
+        Callers must hold self.lock.
+        """
+        if self.total_bytes <= self.max_bytes:
+            return
+
+        files = sorted(self.cache_dir.glob('*.jpg'), key=lambda f: f.stat().st_mtime)
+        for f in files:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                size = f.stat().st_size
+                f.unlink()
+                self.total_bytes -= size
+            except OSError as e:
+                print(f"Error evicting {f}: {str(e)}")
+        print(f"Image cache trimmed to {self.total_bytes} bytes")
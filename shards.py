@@ -0,0 +1,323 @@
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import pathlib
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from tracing import span
+
+# One single-worker executor per shard file, shared per process so Streamlit
+# reruns don't respawn them; each worker owns exactly one shard
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+# The shard owned by this worker process, and the file it is saved to
+_SHARD = {}
+_SHARD_PATH = None
+
+
+def _mp_context():
+    # Forking from Streamlit's threaded server can deadlock, so never use fork
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _get_pool(path: str) -> ProcessPoolExecutor:
+    with _POOLS_LOCK:
+        if path not in _POOLS:
+            _POOLS[path] = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=_mp_context(),
+                initializer=_load_shard,
+                initargs=(path,)
+            )
+        return _POOLS[path]
+
+
+def _close_pool(path: str):
+    with _POOLS_LOCK:
+        pool = _POOLS.pop(path, None)
+    if pool:
+        pool.shutdown(wait=True)
+
+
+def _write_json(path: pathlib.Path, data, **kwargs):
+    """Write JSON to a temp file and rename it so readers never see a partial file."""
+    tmp_file = path.with_suffix('.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, **kwargs)
+    os.replace(tmp_file, path)
+
+
+# Tasks run inside the shard workers
+
+def _load_shard(path: str):
+    """Worker initializer: load this worker's shard file once."""
+    global _SHARD_PATH
+    _SHARD_PATH = path
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            _SHARD.update(json.load(f))
+
+
+def _shard_get(key: str) -> Optional[Dict]:
+    return _SHARD.get(key)
+
+
+def _shard_update(updates: Dict):
+    _SHARD.update(updates)
+
+
+def _shard_save() -> int:
+    _write_json(pathlib.Path(_SHARD_PATH), _SHARD)
+    return len(_SHARD)
+
+
+def _shard_len() -> int:
+    return len(_SHARD)
+
+
+def _shard_items() -> Dict:
+    return _SHARD
+
+
+def _top_k(items: Iterable[Tuple[str, Dict]], scorer: Callable, query, limit: int,
+           exclude: frozenset) -> List[Tuple[float, str, Dict]]:
+    """Score items against the query and keep the `limit` best."""
+    scored = (
+        (scorer(query, value), key, value)
+        for key, value in items
+        if key not in exclude
+    )
+    # Break score ties by key so sharded and unsharded rankings agree
+    return heapq.nlargest(limit, scored, key=lambda entry: (entry[0], entry[1]))
+
+
+def _query_shard(scorer: Callable, query, limit: int,
+                 exclude: frozenset) -> List[Tuple[float, str, Dict]]:
+    """Run a top-k query against this worker's shard."""
+    return _top_k(_SHARD.items(), scorer, query, limit, exclude)
+
+
+def top_k(store, scorer: Callable, query, limit: int, exclude: Iterable[str] = ()) -> List[Dict]:
+    """Return the `limit` values in a cache that score highest against the query.
+
+    `scorer(query, value)` must be a module-level function or staticmethod so
+    it can be sent to worker processes when the store is sharded.
+    """
+    exclude = frozenset(exclude)
+    with span('shards.top_k', limit=limit):
+        if isinstance(store, ShardedStore):
+            return store.top_k(scorer, query, limit, exclude)
+        return [value for _, _, value in _top_k(store.items(), scorer, query, limit, exclude)]
+
+
+# On-disk layout
+
+def shard_files(data_file: pathlib.Path, num_shards: int) -> List[pathlib.Path]:
+    return [data_file.with_name(f'{data_file.stem}_shard_{i}.json') for i in range(num_shards)]
+
+
+def manifest_file(data_file: pathlib.Path) -> pathlib.Path:
+    return data_file.with_name(f'{data_file.stem}_shards.json')
+
+
+def read_shard_count(data_file: pathlib.Path) -> Optional[int]:
+    """Return the shard count recorded next to a cache file, or None if it is unsharded."""
+    manifest = manifest_file(pathlib.Path(data_file))
+    if not manifest.exists():
+        return None
+    with open(manifest, 'r', encoding='utf-8') as f:
+        return json.load(f)['num_shards']
+
+
+def ensure_layout(data_file: pathlib.Path, num_shards: int):
+    """Repartition the cache files under `data_file` into `num_shards` shards if needed.
+
+    A count of 1 means the plain unsharded cache file.
+    """
+    data_file = pathlib.Path(data_file)
+    current = read_shard_count(data_file)
+    # Shard files written without a manifest can't be trusted to match any count
+    unmanaged = sorted(data_file.parent.glob(f'{data_file.stem}_shard_*.json')) if current is None else []
+
+    if current == num_shards or (current is None and num_shards == 1 and not unmanaged):
+        return
+    if current is None and not unmanaged and not data_file.exists():
+        # Fresh cache: nothing to move, just record the layout
+        data_file.parent.mkdir(parents=True, exist_ok=True)
+        _write_json(manifest_file(data_file), {'num_shards': num_shards})
+        return
+
+    # Gather every entry from the existing layout
+    if current is None:
+        sources = ([data_file] if data_file.exists() else []) + unmanaged
+    else:
+        sources = shard_files(data_file, current)
+    entries = {}
+    for source in sources:
+        _close_pool(str(source))
+        if source.exists():
+            with open(source, 'r', encoding='utf-8') as f:
+                entries.update(json.load(f))
+    print(f"Repartitioning {len(entries)} entries of {data_file} from {current or 1} to {num_shards} shards")
+
+    old_shards = [s for s in sources if s != data_file]
+    if num_shards == 1:
+        _write_json(data_file, entries, indent=2)
+    else:
+        buckets = [{} for _ in range(num_shards)]
+        for key, value in entries.items():
+            buckets[shard_index(key, num_shards)][key] = value
+        new_files = shard_files(data_file, num_shards)
+        for shard_file, bucket in zip(new_files, buckets):
+            _close_pool(str(shard_file))
+            _write_json(shard_file, bucket)
+        old_shards = [s for s in old_shards if s not in new_files]
+        # Keep the unsharded file as a backup so shards=1 can't silently read stale data
+        if data_file.exists():
+            data_file.rename(data_file.with_name(
+                f'{data_file.stem}_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
+            ))
+
+    for old_shard in old_shards:
+        old_shard.unlink(missing_ok=True)
+    if num_shards == 1:
+        manifest_file(data_file).unlink(missing_ok=True)
+    else:
+        _write_json(manifest_file(data_file), {'num_shards': num_shards})
+
+
+def shard_index(key: str, num_shards: int) -> int:
+    # crc32 is stable across processes, unlike the built-in hash()
+    return zlib.crc32(key.encode('utf-8')) % num_shards
+
+
+class ShardedStore:
+    """A dict-like cache hash-partitioned across worker processes that each own one shard file.
+
+    The parent keeps only writes that have not reached the workers yet; reads
+    go to the worker that owns the key.
+    """
+
+    def __init__(self, data_file: pathlib.Path, num_shards: int):
+        self.data_file = pathlib.Path(data_file)
+        self.num_shards = num_shards
+        self.shard_files = shard_files(self.data_file, num_shards)
+        self.lock = threading.Lock()
+        # Entries written since the shard workers were last updated
+        self.pending = [{} for _ in range(num_shards)]
+        # Shards changed since the last save
+        self.dirty = set()
+
+    def _pool(self, index: int) -> ProcessPoolExecutor:
+        return _get_pool(str(self.shard_files[index]))
+
+    def _call(self, index: int, func, *args):
+        try:
+            return self._pool(index).submit(func, *args).result()
+        except BrokenProcessPool:
+            # Drop the dead worker so the next call respawns it from the saved shard
+            _close_pool(str(self.shard_files[index]))
+            raise
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __getitem__(self, key: str) -> Dict:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Dict):
+        index = shard_index(key, self.num_shards)
+        with self.lock:
+            self.pending[index][key] = value
+            self.dirty.add(index)
+
+    def get(self, key: str, default=None):
+        index = shard_index(key, self.num_shards)
+        with self.lock:
+            if key in self.pending[index]:
+                return self.pending[index][key]
+        value = self._call(index, _shard_get, key)
+        return default if value is None else value
+
+    def __len__(self) -> int:
+        self.flush_updates()
+        return sum(self._call(index, _shard_len) for index in range(self.num_shards))
+
+    def items(self):
+        """Yield every entry, holding only one shard in the parent at a time."""
+        self.flush_updates()
+        for index in range(self.num_shards):
+            yield from self._call(index, _shard_items).items()
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def load(self):
+        """Repartition the files if the shard count changed, then start the shard workers."""
+        ensure_layout(self.data_file, self.num_shards)
+        print(f"Loaded {len(self)} entries from {self.num_shards} shards of {self.data_file}")
+
+    def flush_updates(self):
+        """Send pending writes to the shard workers and wait until they are applied."""
+        with self.lock:
+            pending = self.pending
+            self.pending = [{} for _ in range(self.num_shards)]
+        futures = [
+            (index, self._pool(index).submit(_shard_update, updates))
+            for index, updates in enumerate(pending) if updates
+        ]
+        for index, future in futures:
+            try:
+                future.result()
+            except Exception:
+                # Put the writes back so a later flush can retry them
+                with self.lock:
+                    for key, value in pending[index].items():
+                        self.pending[index].setdefault(key, value)
+                if isinstance(future.exception(), BrokenProcessPool):
+                    _close_pool(str(self.shard_files[index]))
+                raise
+
+    def save(self):
+        """Have the workers write only the shards that changed since the last save."""
+        self.flush_updates()
+        with self.lock:
+            dirty = sorted(self.dirty)
+            self.dirty = set()
+        for index in dirty:
+            self._call(index, _shard_save)
+        if dirty:
+            print(f"Saved {len(dirty)} of {self.num_shards} shards of {self.data_file}")
+
+    def top_k(self, scorer: Callable, query, limit: int, exclude: frozenset) -> List[Dict]:
+        """Fan a top-k query out to one worker per shard and merge the results."""
+        with span('shards.flush_updates'):
+            self.flush_updates()
+        with span('shards.scatter_gather', shards=self.num_shards, limit=limit):
+            # Each shard's worker runs tasks in order, so updates land before the query
+            futures = [
+                (index, self._pool(index).submit(_query_shard, scorer, query, limit, exclude))
+                for index in range(self.num_shards)
+            ]
+            partials = []
+            for index, future in futures:
+                try:
+                    partials.append(future.result())
+                except BrokenProcessPool:
+                    _close_pool(str(self.shard_files[index]))
+                    raise
+        merged = heapq.nlargest(limit, itertools.chain.from_iterable(partials), key=lambda e: (e[0], e[1]))
+        return [value for _, _, value in merged]
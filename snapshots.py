@@ -0,0 +1,173 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import pathlib
+import socket
+import tempfile
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from shards import read_shard_count
+
+SNAPSHOT_FORMAT = 'spotify-cache-snapshot'
+SNAPSHOT_VERSION = 1
+
+# Identifies this node in snapshots so peers can track what they have seen from it
+NODE_ID = os.getenv('SPOTIFY_NODE_ID', socket.gethostname())
+
+
+def _checksum(entries: Dict) -> str:
+    """Hash the canonical JSON form of the entries."""
+    canonical = json.dumps(entries, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _parse_time(value: Optional[str]) -> datetime:
+    # Entries without a timestamp lose to any timestamped copy
+    if not value:
+        return datetime.min.replace(tzinfo=timezone.utc)
+    # Older caches wrote naive datetime.now() values, i.e. this host's local
+    # time; astimezone() reads a naive value as local time
+    return datetime.fromisoformat(value).astimezone(timezone.utc)
+
+
+def _changed_at(entry: Dict) -> datetime:
+    """When an entry last changed on this node, whether fetched or merged from a peer."""
+    return max(_parse_time(entry.get('last_updated')), _parse_time(entry.get('synced_at')))
+
+
+def export_snapshot(cache, path: pathlib.Path, store: str, since: Optional[str] = None) -> int:
+    """Write cache entries changed since `since` (or all of them) to a compressed snapshot.
+
+    `since` should be the `created` watermark the requesting peer recorded
+    when it last imported a snapshot from this node.
+    """
+    # Take the watermark before scanning so concurrent writes land in the next delta
+    created = datetime.now(timezone.utc).isoformat()
+    since_time = _parse_time(since)
+    entries = {
+        key: entry for key, entry in cache.items()
+        if since is None or _changed_at(entry) >= since_time
+    }
+
+    snapshot = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'store': store,
+        'node': NODE_ID,
+        'created': created,
+        'since': since,
+        'count': len(entries),
+        'checksum': _checksum(entries),
+        'entries': entries
+    }
+
+    # Write to a temp file and rename it so peers never read a partial snapshot
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'), ensure_ascii=False)
+        os.replace(tmp_name, path)
+    except Exception:
+        os.unlink(tmp_name)
+        raise
+    print(f"Exported {len(entries)} {store} entries to {path}")
+    return len(entries)
+
+
+def read_snapshot(path: pathlib.Path, store: str) -> Dict:
+    """Read and verify a snapshot, raising ValueError if it is not usable."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        snapshot = json.load(f)
+
+    if snapshot.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"{path} is not a cache snapshot")
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {snapshot.get('version')} in {path}")
+    if snapshot.get('store') != store:
+        raise ValueError(f"{path} holds {snapshot.get('store')} data, expected {store}")
+    if _checksum(snapshot['entries']) != snapshot['checksum']:
+        raise ValueError(f"Checksum mismatch in {path}")
+
+    return snapshot
+
+
+def merge_entries(cache, entries: Dict) -> int:
+    """Merge entries into a cache, keeping whichever copy was updated last."""
+    merged = 0
+    synced_at = datetime.now(timezone.utc).isoformat()
+    for key, entry in entries.items():
+        current = cache.get(key)
+        if current is None or _parse_time(entry.get('last_updated')) > _parse_time(current.get('last_updated')):
+            # Stamp the arrival time so this node's own deltas include the entry
+            cache[key] = dict(entry, synced_at=synced_at)
+            merged += 1
+    return merged
+
+
+def load_watermarks(path: pathlib.Path) -> Dict:
+    """Load the per-peer high-water marks recorded by earlier imports."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def record_watermark(path: pathlib.Path, snapshot: Dict):
+    """Remember the newest snapshot imported from a peer, for its next delta export."""
+    watermarks = load_watermarks(path)
+    node = snapshot.get('node')
+    current = watermarks.get(node)
+    if node is None or (current and _parse_time(current) >= _parse_time(snapshot['created'])):
+        return
+    watermarks[node] = snapshot['created']
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(watermarks, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export or import artist/song cache snapshots.')
+    parser.add_argument('action', choices=['export', 'import', 'watermark'])
+    parser.add_argument('store', choices=['artist', 'song'])
+    parser.add_argument('target', nargs='?', help='Snapshot file to write or read, or the peer node for watermark')
+    parser.add_argument('--since', help="Only export entries changed after this watermark (from the peer's 'watermark' command)")
+    parser.add_argument('--shards', type=int, default=int(os.getenv('SPOTIFY_CACHE_SHARDS', '1')),
+                        help='Number of cache shards (defaults to SPOTIFY_CACHE_SHARDS, like the app)')
+    args = parser.parse_args()
+
+    if not args.target:
+        parser.error(f"{args.action} needs a {'peer node' if args.action == 'watermark' else 'snapshot path'}")
+
+    # Opening an engine with another shard count would repartition the files
+    # under a running app, so insist on the count they were written with
+    data_file = pathlib.Path(f'Spotify/{args.store}_cache.json')
+    on_disk = read_shard_count(data_file)
+    if on_disk is None and any(data_file.parent.glob(f'{data_file.stem}_shard_*.json')):
+        parser.error(f"{data_file} has shard files but no shard manifest; run the app once to repartition them")
+    on_disk = on_disk or 1
+    if on_disk != args.shards:
+        parser.error(f"{data_file} is stored in {on_disk} shard(s) but --shards is {args.shards}")
+
+    # The engines only need a Spotify client for fetching, not for cache access
+    if args.store == 'artist':
+        from artist import ArtistSimilarity
+        engine = ArtistSimilarity(None, shards=args.shards)
+    else:
+        from songs import SongSimilarity
+        engine = SongSimilarity(None, shards=args.shards)
+
+    if args.action == 'watermark':
+        print(engine.peer_watermark(args.target) or '')
+    elif args.action == 'export':
+        engine.export_snapshot(args.target, since=args.since)
+    else:
+        engine.import_snapshot(args.target)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,23 +2,43 @@ import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 import pandas as pd
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Iterator
 import json
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 import pathlib
+from shards import ShardedStore, ensure_layout, top_k
+from tracing import traced
+import snapshots
+
+# Every viewed song is cached, so back up at most hourly and keep only a few
+BACKUP_INTERVAL_SECONDS = 3600
+MAX_BACKUPS = 5
 
 class SongSimilarity:
-    def __init__(self, sp_client: spotipy.Spotify):
+    def __init__(self, sp_client: spotipy.Spotify, shards: int = 1):
         self.sp = sp_client
         self.cache = {}
         # Use the Spotify folder for cache
         self.data_file = pathlib.Path('Spotify/song_cache.json')
+        # High-water marks of snapshots imported from each peer node
+        self.peers_file = pathlib.Path('Spotify/song_peers.json')
+        # Partition the cache across shard files queried by worker processes
+        if shards > 1:
+            self.cache = ShardedStore(self.data_file, shards)
         self.load_cached_data()
         
+    @traced('song_cache.load')
     def load_cached_data(self):
         """Load song data from local storage."""
+        if isinstance(self.cache, ShardedStore):
+            self.cache.load()
+            return
+
         try:
+            # Fold shard files from an earlier sharded run back into the single file
+            ensure_layout(self.data_file, 1)
             if self.data_file.exists():
                 with open(self.data_file, 'r', encoding='utf-8') as f:
                     self.cache = json.load(f)
@@ -35,16 +55,26 @@ class SongSimilarity:
             self.cache = {}
             self.save_cached_data()
     
+    @traced('song_cache.save')
     def save_cached_data(self):
         """Save song data to local storage."""
+        if isinstance(self.cache, ShardedStore):
+            self.cache.save()
+            return
+
         try:
-            # Create backup of existing file if it exists
-            if self.data_file.exists():
+            # Create backup of existing file if it exists and the last one is old enough
+            backup_files = sorted(self.data_file.parent.glob('song_cache_backup_*.json'), key=lambda x: x.stat().st_mtime)
+            backup_due = not backup_files or time.time() - backup_files[-1].stat().st_mtime > BACKUP_INTERVAL_SECONDS
+            if self.data_file.exists() and backup_due:
                 backup_file = self.data_file.parent / f'song_cache_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
                 with open(self.data_file, 'r', encoding='utf-8') as src, \
                      open(backup_file, 'w', encoding='utf-8') as dst:
                     dst.write(src.read())
                 print(f"Created backup at {backup_file}")
+                backup_files.append(backup_file)
+            for old_backup in backup_files[:-MAX_BACKUPS]:
+                old_backup.unlink()
 
             # Save new data
             with open(self.data_file, 'w', encoding='utf-8') as f:
@@ -64,35 +94,51 @@ class SongSimilarity:
                 except Exception as backup_error:
                     print(f"Error restoring from backup: {str(backup_error)}")
 
-    def get_song_features(self, track_id: str) -> Dict:
-        """Get essential features for a song."""
-        if track_id in self.cache:
+    def export_snapshot(self, path: str, since: str = None) -> int:
+        """Export song data (or only entries changed after a peer's `since` watermark) to a snapshot file."""
+        try:
+            return snapshots.export_snapshot(self.cache, pathlib.Path(path), 'song', since=since)
+        except Exception as e:
+            print(f"Error exporting snapshot: {str(e)}")
+            return 0
+
+    @traced('song_cache.import_snapshot')
+    def import_snapshot(self, path: str) -> int:
+        """Merge a peer's snapshot into the cache, keeping the newest copy of each song."""
+        try:
+            snapshot = snapshots.read_snapshot(pathlib.Path(path), 'song')
+            merged = snapshots.merge_entries(self.cache, snapshot['entries'])
+            print(f"Merged {merged} of {snapshot['count']} songs from {path}")
+            if merged:
+                self.save_cached_data()
+            snapshots.record_watermark(self.peers_file, snapshot)
+            return merged
+        except Exception as e:
+            print(f"Error importing snapshot: {str(e)}")
+            return 0
+
+    def peer_watermark(self, node: str) -> str:
+        """Return the `since` value to request the next delta from a peer node."""
+        return snapshots.load_watermarks(self.peers_file).get(node)
+
+    @traced('song.get_song_features')
+    def get_song_features(self, track_id: str, track: Dict = None) -> Dict:
+        """Get essential features for a song, reusing `track` if the caller already has it."""
+        cached = self.cache.get(track_id)
+        if cached:
             print(f"Retrieved song from cache")
-            return self.cache[track_id]
+            return cached
             
         try:
             # Get track info
-            track = self.sp.track(track_id)
+            if track is None:
+                track = self.sp.track(track_id)
             
             # Get audio features
             audio_features = self.sp.audio_features(track_id)[0]
             
             # Combine track info and audio features
-            features = {
-                'id': track_id,
-                'name': track['name'],
-                'artist': track['artists'][0]['name'],
-                'album': track['album']['name'],
-                'popularity': track['popularity'],
-                'duration_ms': track['duration_ms'],
-                'explicit': track['explicit'],
-                'danceability': audio_features['danceability'],
-                'energy': audio_features['energy'],
-                'valence': audio_features['valence'],
-                'tempo': audio_features['tempo'],
-                'image_url': track['album']['images'][0]['url'] if track['album']['images'] else None,
-                'last_updated': datetime.now().isoformat()
-            }
+            features = self._build_features(track, audio_features)
             
             # Cache the results
             self.cache[track_id] = features
@@ -104,6 +150,155 @@ class SongSimilarity:
             print(f"Error getting features for song {track_id}: {str(e)}")
             return None
 
+    def _build_features(self, track: Dict, audio_features: Dict) -> Dict:
+        """Combine a track object and its audio features into a cache entry."""
+        return {
+            'id': track['id'],
+            'name': track['name'],
+            'artist': track['artists'][0]['name'],
+            'album': track['album']['name'],
+            'popularity': track['popularity'],
+            'duration_ms': track['duration_ms'],
+            'explicit': track['explicit'],
+            'danceability': audio_features['danceability'],
+            'energy': audio_features['energy'],
+            'valence': audio_features['valence'],
+            'tempo': audio_features['tempo'],
+            'image_url': track['album']['images'][0]['url'] if track['album']['images'] else None,
+            'last_updated': datetime.now(timezone.utc).isoformat()
+        }
+
+    @staticmethod
+    def _feature_vector(features: Dict) -> np.ndarray:
+        """Scale the features used for playlist matching to roughly [0, 1]."""
+        return np.array([
+            features['danceability'],
+            features['energy'],
+            features['valence'],
+            features['tempo'] / 200,  # Normalize tempo
+            features['popularity'] / 100
+        ])
+
+    @staticmethod
+    def _centroid_score(centroid: np.ndarray, features: Dict) -> float:
+        """Score a song by its closeness to a playlist centroid."""
+        return -float(np.linalg.norm(SongSimilarity._feature_vector(features) - centroid))
+
+    def iter_playlist_tracks(self, playlist_id: str, page_size: int = 100) -> Iterator[Dict]:
+        """Yield the tracks of a playlist one page at a time."""
+        page = self.sp.playlist_items(playlist_id, limit=page_size, additional_types=('track',))
+        while page:
+            for item in page['items']:
+                track = item.get('track')
+                # Skip local files, episodes and removed tracks
+                if track and track.get('id') and track.get('type') == 'track':
+                    yield track
+            page = self.sp.next(page) if page['next'] else None
+
+    def iter_playlist_features(self, playlist_id: str, batch_size: int = 100) -> Iterator[Dict]:
+        """Yield features for every track in a playlist, fetching missing ones in batches."""
+        batch = []
+        added = 0
+
+        def flush(tracks):
+            # audio_features accepts up to 100 IDs per request
+            audio_features = self.sp.audio_features([t['id'] for t in tracks])
+            for track, audio_feat in zip(tracks, audio_features):
+                if audio_feat:  # Check if audio features exist
+                    self.cache[track['id']] = self._build_features(track, audio_feat)
+                    yield self.cache[track['id']]
+
+        try:
+            for track in self.iter_playlist_tracks(playlist_id):
+                cached = self.cache.get(track['id'])
+                if cached:
+                    yield cached
+                    continue
+                batch.append(track)
+                if len(batch) >= batch_size:
+                    for features in flush(batch):
+                        added += 1
+                        yield features
+                    batch = []
+
+            if batch:
+                for features in flush(batch):
+                    added += 1
+                    yield features
+        finally:
+            # Write the cache once per playlist rather than once per track, and
+            # keep the batches already fetched if paging fails part way through
+            if added:
+                print(f"Loaded {added} new songs from playlist {playlist_id}")
+                self.save_cached_data()
+
+    @traced('song.build_playlist_profile')
+    def build_playlist_profile(self, playlist_id: str) -> Dict:
+        """Build a centroid feature profile for a playlist."""
+        total = None
+        count = 0
+        track_ids = set()
+
+        for features in self.iter_playlist_features(playlist_id):
+            vector = self._feature_vector(features)
+            total = vector if total is None else total + vector
+            count += 1
+            track_ids.add(features['id'])
+
+        if not count:
+            return None
+
+        return {
+            'playlist_id': playlist_id,
+            'centroid': total / count,
+            'track_count': count,
+            'track_ids': track_ids
+        }
+
+    @traced('song.recommend_from_playlist')
+    def recommend_from_playlist(self, playlist_id: str, limit: int = 10) -> List[Dict]:
+        """Rank cached songs by distance to a playlist's centroid."""
+        try:
+            profile = self.build_playlist_profile(playlist_id)
+            return self.recommend_from_profile(profile, limit)
+
+        except Exception as e:
+            print(f"Error recommending from playlist {playlist_id}: {str(e)}")
+            return []
+
+    def recommend_from_profile(self, profile: Dict, limit: int = 10) -> List[Dict]:
+        """Rank cached songs by distance to a prebuilt playlist profile."""
+        if not profile:
+            return []
+
+        return top_k(
+            self.cache,
+            SongSimilarity._centroid_score,
+            profile['centroid'],
+            limit,
+            exclude=profile['track_ids']
+        )
+
+    @traced('song.find_similar_cached_songs')
+    def find_similar_cached_songs(self, track_id: str, limit: int = 3, track: Dict = None) -> List[Dict]:
+        """Rank cached songs by closeness to the given song."""
+        features = self.get_song_features(track_id, track=track)
+        if not features:
+            return []
+
+        try:
+            return top_k(
+                self.cache,
+                SongSimilarity._centroid_score,
+                SongSimilarity._feature_vector(features),
+                limit,
+                exclude=[track_id]
+            )
+        except Exception as e:
+            print(f"Error ranking cached songs: {str(e)}")
+            return []
+
+    @traced('song.find_similar_songs')
     def find_similar_songs(self, track_id: str, limit: int = 3) -> List[Dict]:
         """Find popular songs to display in the similar songs section."""
         try:
@@ -1,8 +1,10 @@
+import re
+from functools import lru_cache
+
 import streamlit as st
 
-def apply_custom_style():
-    """Apply custom CSS styling to the app"""
-    st.markdown("""
+# Raw CSS for the app; minified once per process by _minified_css()
+CUSTOM_CSS = """
         <style>
         /* Main container styling */
         .main {
@@ -178,53 +180,93 @@ def apply_custom_style():
             background-color: #1DB954;
         }
         </style>
-    """, unsafe_allow_html=True)
+    """
+
+@lru_cache(maxsize=1)
+def _minified_css():
+    """Collapse comments and whitespace in CUSTOM_CSS to shrink the per-rerun payload"""
+    css = re.sub(r'/\*.*?\*/', '', CUSTOM_CSS, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    return re.sub(r'\s*([{};:,>])\s*', r'\1', css).strip()
+
+def apply_custom_style():
+    """Apply custom CSS styling to the app"""
+    # Streamlit drops any element not re-emitted on a rerun, so the style tag
+    # has to be sent every run; only the minification is done once.
+    st.markdown(_minified_css(), unsafe_allow_html=True)
 
-def create_track_card(track):
+def create_track_card(track, image_src=None):
     """Create a styled track card with track information"""
-    st.markdown(f"""
+    # Prefer a right-sized image over the full-size CDN image
+    if image_src is None:
+        image_src = track['album']['images'][0]['url']
+
+    st.markdown(_render_track_card(
+        track['name'], track['artists'][0]['name'], track['album']['name'],
+        track['external_urls']['spotify'], image_src
+    ), unsafe_allow_html=True)
+
+@lru_cache(maxsize=256)
+def _render_track_card(name, artist_name, album_name, spotify_url, image_src):
+    """Render track card markup, memoized by the fields it displays"""
+    return f"""
         <div class="card">
             <div style="display: flex; align-items: center; gap: 20px;">
-                <img src="{track['album']['images'][0]['url']}" width="150" style="border-radius: 10px;">
+                <img src="{image_src}" width="150" style="border-radius: 10px;">
                 <div>
-                    <h2 style="color: #FFFFFF; margin: 0;">{track['name']}</h2>
-                    <p style="color: #B3B3B3; margin: 5px 0;">{track['artists'][0]['name']}</p>
-                    <p style="color: #B3B3B3; margin: 5px 0;">{track['album']['name']}</p>
-                    <a href="{track['external_urls']['spotify']}" target="_blank" style="color: #1DB954; text-decoration: none;">
+                    <h2 style="color: #FFFFFF; margin: 0;">{name}</h2>
+                    <p style="color: #B3B3B3; margin: 5px 0;">{artist_name}</p>
+                    <p style="color: #B3B3B3; margin: 5px 0;">{album_name}</p>
+                    <a href="{spotify_url}" target="_blank" style="color: #1DB954; text-decoration: none;">
                         Open in Spotify
                     </a>
                 </div>
             </div>
         </div>
-    """, unsafe_allow_html=True)
+    """
 
-def create_playlist_card(playlist):
+def create_playlist_card(playlist, image_src=None):
     """Create a styled playlist card"""
-    # Get the first image from the playlist
-    image_url = playlist['images'][0]['url'] if playlist['images'] else "https://community.spotify.com/t5/image/serverpage/image-id/25294i2836BD1C1A31BDF2/image-size/medium"
+    # Get the first image from the playlist unless a right-sized one was given
+    image_url = image_src or (playlist['images'][0]['url'] if playlist['images'] else "https://community.spotify.com/t5/image/serverpage/image-id/25294i2836BD1C1A31BDF2/image-size/medium")
     
-    st.markdown(f"""
+    st.markdown(_render_playlist_card(
+        playlist['name'], playlist['tracks']['total'],
+        playlist['owner']['display_name'], playlist['external_urls']['spotify'], image_url
+    ), unsafe_allow_html=True)
+
+@lru_cache(maxsize=256)
+def _render_playlist_card(name, total_tracks, owner_name, spotify_url, image_url):
+    """Render playlist card markup, memoized by the fields it displays"""
+    return f"""
         <div class="playlist-card">
             <img src="{image_url}" class="playlist-image">
-            <div class="playlist-name">{playlist['name']}</div>
+            <div class="playlist-name">{name}</div>
             <div class="playlist-info">
-                {playlist['tracks']['total']} tracks • {playlist['owner']['display_name']}
+                {total_tracks} tracks • {owner_name}
             </div>
-            <a href="{playlist['external_urls']['spotify']}" target="_blank" style="color: #1DB954; text-decoration: none;">
+            <a href="{spotify_url}" target="_blank" style="color: #1DB954; text-decoration: none;">
                 Open in Spotify
             </a>
         </div>
-    """, unsafe_allow_html=True)
+    """
 
 def create_stats_section(track):
     """Create a styled stats section for track information"""
-    duration_min = int(track['duration_ms']/1000//60)
-    duration_sec = int(track['duration_ms']/1000%60)
+    st.markdown(_render_stats_section(
+        track['popularity'], track['duration_ms'], len(track['available_markets'])
+    ), unsafe_allow_html=True)
+
+@lru_cache(maxsize=256)
+def _render_stats_section(popularity, duration_ms, markets_count):
+    """Render stats section markup, memoized by the fields it displays"""
+    duration_min = int(duration_ms/1000//60)
+    duration_sec = int(duration_ms/1000%60)
     
-    st.markdown(f"""
+    return f"""
         <div class="stats">
             <div class="stat-item">
-                <div class="stat-value">{track['popularity']}</div>
+                <div class="stat-value">{popularity}</div>
                 <div class="stat-label">Popularity</div>
             </div>
             <div class="stat-item">
@@ -232,11 +274,11 @@ def create_stats_section(track):
                 <div class="stat-label">Duration</div>
             </div>
             <div class="stat-item">
-                <div class="stat-value">{len(track['available_markets'])}</div>
+                <div class="stat-value">{markets_count}</div>
                 <div class="stat-label">Markets</div>
             </div>
         </div>
-    """, unsafe_allow_html=True)
+    """
 
 def create_search_bar():
     """Create a styled search bar"""
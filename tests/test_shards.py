@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+import shards
+from shards import ShardedStore, ensure_layout, top_k
+
+
+def score_popularity(query, entry):
+    """Module-level so it can be pickled into the shard workers."""
+    return -abs(entry['popularity'] - query)
+
+
+def make_entries(count):
+    return {f'track{i}': {'id': f'track{i}', 'popularity': (i * 37) % 101} for i in range(count)}
+
+
+@pytest.fixture(autouse=True)
+def close_pools():
+    yield
+    for path in list(shards._POOLS):
+        shards._close_pool(path)
+
+
+def open_store(data_file, num_shards):
+    store = ShardedStore(data_file, num_shards)
+    store.load()
+    return store
+
+
+def test_sharded_top_k_matches_dict(tmp_path):
+    entries = make_entries(300)
+    store = open_store(tmp_path / 'song_cache.json', 4)
+    for key, value in entries.items():
+        store[key] = value
+    store.save()
+
+    expected = top_k(entries, score_popularity, 50, 10, exclude=['track0'])
+    assert top_k(store, score_popularity, 50, 10, exclude=['track0']) == expected
+
+
+def test_write_after_workers_start_is_visible(tmp_path):
+    store = open_store(tmp_path / 'song_cache.json', 3)
+    store['a'] = {'id': 'a', 'popularity': 10}
+    assert [e['id'] for e in top_k(store, score_popularity, 10, 1)] == ['a']
+
+    # The workers are running now; new writes must reach them without a save
+    store['b'] = {'id': 'b', 'popularity': 42}
+    assert [e['id'] for e in top_k(store, score_popularity, 42, 1)] == ['b']
+    assert store.get('b')['popularity'] == 42
+    assert 'b' in store and len(store) == 2
+
+
+def test_changing_shard_count_repartitions(tmp_path):
+    data_file = tmp_path / 'song_cache.json'
+    entries = make_entries(200)
+    store = open_store(data_file, 4)
+    for key, value in entries.items():
+        store[key] = value
+    store.save()
+
+    store = open_store(data_file, 8)
+    assert all(key in store for key in entries)
+    assert dict(store.items()) == entries
+    assert shards.read_shard_count(data_file) == 8
+
+    ensure_layout(data_file, 1)
+    with open(data_file, 'r', encoding='utf-8') as f:
+        assert json.load(f) == entries
+    assert shards.read_shard_count(data_file) is None
+    assert not list(tmp_path.glob('song_cache_shard_*.json'))
+
+
+def test_unsharded_cache_is_partitioned_and_backed_up(tmp_path):
+    data_file = tmp_path / 'song_cache.json'
+    entries = make_entries(50)
+    with open(data_file, 'w', encoding='utf-8') as f:
+        json.dump(entries, f)
+
+    store = open_store(data_file, 2)
+    assert dict(store.items()) == entries
+    assert not data_file.exists()
+    assert list(tmp_path.glob('song_cache_backup_*.json'))
@@ -0,0 +1,71 @@
+import gzip
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import snapshots
+
+
+def make_entry(key, last_updated):
+    return {'id': key, 'name': f'Song {key}', 'last_updated': last_updated}
+
+
+def test_export_import_delta_round_trip(tmp_path):
+    source = {
+        'a': make_entry('a', '2024-01-01T00:00:00+00:00'),
+        'b': make_entry('b', '2024-01-02T00:00:00+00:00'),
+    }
+    peer = {'a': make_entry('a', '2023-12-01T00:00:00+00:00')}
+    peers_file = tmp_path / 'song_peers.json'
+
+    # Full export: the peer takes the newer 'a' and the missing 'b'
+    full = tmp_path / 'full.json.gz'
+    assert snapshots.export_snapshot(source, full, 'song') == 2
+    snapshot = snapshots.read_snapshot(full, 'song')
+    assert snapshots.merge_entries(peer, snapshot['entries']) == 2
+    assert peer['a']['last_updated'] == source['a']['last_updated']
+    snapshots.record_watermark(peers_file, snapshot)
+    since = snapshots.load_watermarks(peers_file)[snapshots.NODE_ID]
+    assert since == snapshot['created']
+
+    # Only entries changed after the watermark go into the delta
+    source['c'] = make_entry('c', '2099-01-01T00:00:00+00:00')
+    delta = tmp_path / 'delta.json.gz'
+    assert snapshots.export_snapshot(source, delta, 'song', since=since) == 1
+    snapshot = snapshots.read_snapshot(delta, 'song')
+    assert list(snapshot['entries']) == ['c']
+    assert snapshots.merge_entries(peer, snapshot['entries']) == 1
+    assert set(peer) == {'a', 'b', 'c'}
+
+    # Re-importing the same snapshot changes nothing
+    assert snapshots.merge_entries(peer, snapshot['entries']) == 0
+
+
+def test_merged_entries_are_relayed_in_deltas(tmp_path):
+    # An entry merged after a peer's watermark must reach that peer, even if
+    # it was fetched elsewhere before the watermark
+    node = {}
+    since = '2024-06-01T00:00:00+00:00'
+    snapshots.merge_entries(node, {'a': make_entry('a', '2024-01-01T00:00:00+00:00')})
+    path = tmp_path / 'delta.json.gz'
+    assert snapshots.export_snapshot(node, path, 'song', since=since) == 1
+
+
+def test_checksum_mismatch_is_rejected(tmp_path):
+    path = tmp_path / 'snapshot.json.gz'
+    snapshots.export_snapshot({'a': make_entry('a', '2024-01-01T00:00:00+00:00')}, path, 'song')
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    snapshot['entries']['a']['name'] = 'Tampered'
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        json.dump(snapshot, f)
+
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        snapshots.read_snapshot(path, 'song')
+
+
+def test_naive_timestamps_are_local_time():
+    naive = snapshots._parse_time('2024-01-01T12:00:00')
+    assert naive.tzinfo is not None
+    assert naive == datetime(2024, 1, 1, 12, 0).astimezone(timezone.utc)
@@ -0,0 +1,213 @@
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pathlib
+import pstats
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict
+
+# Tracing is opt-in; when it is off every hook below is a plain pass-through
+ENABLED = os.getenv('SPOTIFY_TRACE', '0') == '1'
+# Only requests slower than this are written to disk
+THRESHOLD_MS = float(os.getenv('SPOTIFY_TRACE_THRESHOLD_MS', '1000'))
+# Use the Spotify folder for traces
+TRACE_DIR = pathlib.Path(os.getenv('SPOTIFY_TRACE_DIR', 'Spotify/traces'))
+# Oldest trace and profile files are deleted beyond this many of each
+MAX_TRACE_FILES = int(os.getenv('SPOTIFY_TRACE_KEEP', '100'))
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+# Only one run can be profiled at a time per process
+_profile_lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+        self.children = []
+        self.start = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self.start) * 1000
+
+    def to_dict(self) -> Dict:
+        data = {
+            'name': self.name,
+            'duration_ms': round(self.duration_ms or 0.0, 3),
+        }
+        if self.attrs:
+            data['attrs'] = self.attrs
+        if self.error:
+            data['error'] = self.error
+        if self.children:
+            data['children'] = [child.to_dict() for child in self.children]
+        return data
+
+
+@contextmanager
+def _noop():
+    yield None
+
+
+@contextmanager
+def _record(name: str, attrs: Dict):
+    parent = _current_span.get()
+    span = Span(name, attrs)
+    if parent is not None:
+        parent.children.append(span)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.error = str(e)
+        raise
+    finally:
+        span.finish()
+        _current_span.reset(token)
+
+
+def span(name: str, **attrs):
+    """Record a nested span inside the current request trace."""
+    if not ENABLED or _current_span.get() is None:
+        return _noop()
+    return _record(name, attrs)
+
+
+def traced(name: str):
+    """Decorator that records a span around every call of a function."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED or _current_span.get() is None:
+                return func(*args, **kwargs)
+            with _record(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**attrs):
+    """Add attributes to the current span, if there is one."""
+    current = _current_span.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def _start_profiler():
+    """Start cProfile for this run, unless another run is already being profiled."""
+    if not _profile_lock.acquire(blocking=False):
+        print("Skipping profile: another run is already being profiled")
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Python 3.12+ refuses to nest with another active profiler
+        print(f"Skipping profile: {str(e)}")
+        _profile_lock.release()
+        return None
+    return profiler
+
+
+@contextmanager
+def trace_request(name: str, profile: bool = False, **attrs):
+    """Trace one page render and save it if it exceeds the latency threshold.
+
+    Pass profile=True to attach cProfile to this run only; the trace and
+    profile are then saved whatever the latency. Like the rest of tracing,
+    profiling only happens when SPOTIFY_TRACE=1.
+    """
+    if not ENABLED:
+        yield None
+        return
+
+    profiler = None
+    root = None
+    try:
+        with _record(name, attrs) as root:
+            if profile:
+                profiler = _start_profiler()
+            try:
+                yield root
+            finally:
+                if profiler:
+                    profiler.disable()
+                    _profile_lock.release()
+    finally:
+        if root is not None and (profiler or root.duration_ms >= THRESHOLD_MS):
+            save_trace(root, profiler)
+
+
+def save_trace(root: Span, profiler: cProfile.Profile = None):
+    """Write a span tree (and optional profile) to the trace folder."""
+    try:
+        TRACE_DIR.mkdir(parents=True, exist_ok=True)
+        trace_id = f'{datetime.now().strftime("%Y%m%d_%H%M%S")}_{uuid.uuid4().hex[:8]}'
+        trace = {
+            'trace_id': trace_id,
+            'timestamp': datetime.now().isoformat(),
+            'threshold_ms': THRESHOLD_MS,
+            'root': root.to_dict()
+        }
+
+        if profiler:
+            profile_file = TRACE_DIR / f'profile_{trace_id}.prof'
+            profiler.dump_stats(str(profile_file))
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(25)
+            trace['profile_file'] = str(profile_file)
+            trace['profile_summary'] = summary.getvalue()
+
+        trace_file = TRACE_DIR / f'trace_{trace_id}.json'
+        with open(trace_file, 'w', encoding='utf-8') as f:
+            json.dump(trace, f, indent=2, ensure_ascii=False)
+        print(f"Saved {root.duration_ms:.0f}ms trace for {root.name} to {trace_file}")
+        prune_traces()
+
+    except Exception as e:
+        print(f"Error saving trace: {str(e)}")
+
+
+def prune_traces():
+    """Delete the oldest traces and profiles beyond MAX_TRACE_FILES of each."""
+    for pattern in ('trace_*.json', 'profile_*.prof'):
+        # Names start with a timestamp, so they sort oldest first
+        files = sorted(TRACE_DIR.glob(pattern))
+        for old_file in files[:-MAX_TRACE_FILES] if MAX_TRACE_FILES > 0 else files:
+            try:
+                old_file.unlink()
+            except OSError as e:
+                print(f"Error removing old trace {old_file}: {str(e)}")
+
+
+class TracedClient:
+    """Wraps a Spotify client so each API call becomes a span."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, attr):
+        value = getattr(self._client, attr)
+        if not callable(value):
+            return value
+
+        @functools.wraps(value)
+        def wrapper(*args, **kwargs):
+            with span(f'spotify.{attr}'):
+                return value(*args, **kwargs)
+        return wrapper
+
+
+def traced_client(client):
+    """Return a tracing wrapper for a Spotify client, or the client itself when tracing is off."""
+    return TracedClient(client) if ENABLED else client